@@ -1,37 +1,91 @@
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
+import atexit
+import functools
+import itertools
+import logging
+import os
+import platform
+import sys
 import threading
 import time
+from collections import OrderedDict
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+WARNING_CODES = {10090, 10167} # Advarsler der forespørselen fortsetter og data fortsatt kommer
+
+def is_warning(errorCode): # Advarsler avslutter ikke forespørselen eller tilkoblingen
+  return 2100 <= errorCode <= 2199 or errorCode in WARNING_CODES
 
 class TradingApp(EWrapper, EClient):
   def __init__(self):
     EClient.__init__(self, self)
-    self.data = {} # Lagringsplass for mottatte data
+    self.data = OrderedDict() # Lagringsplass for mottatte data (eldste fjernes først)
+    self.pending = {} # Event per reqId som signaliseres når svar (eller feil) er mottatt
+    self.errors = {} # Feilmeldinger fra IB per reqId
     self.connected = False
+    self.connected_event = threading.Event() # Signaliseres ved tilkobling eller feil
     self.connection_error = None
     self.next_valid_id = None
+    self.req_ids = None # Teller for reqId, starter på next_valid_id
+    self.reader_thread = None # Tråden som leser meldinger fra IB
+    self.bucket = TokenBucket() # Holder oss under IBs grense på 50 meldinger/s
     
   def error(self, reqId, errorCode, errorString):
     if errorCode in [2104, 2106, 2158]: # Disse er informasjonsmeldinger som alltid kommer
       pass
     else:
       print(f"Error*: {reqId} | {errorCode} | {errorString}")
-      self.connection_error = errorString
+      if is_warning(errorCode): # Bare informasjon, data kommer fortsatt
+        return
+      ev = self.pending.get(reqId)
+      if ev: # Feil på en forespørsel, vekk den som venter
+        self.errors[reqId] = errorString
+        ev.set()
+      else:
+        self.connection_error = errorString
+        self.connected_event.set() # Vekk ventende tilkobling slik at feilen kan rapporteres
 
   def connectAck(self):
     self.connected = True
+    self.data.clear() # Data fra en tidligere tilkobling er ikke lenger gyldig
+    if self.next_valid_id is not None:
+      self.connected_event.set()
     print("Tilkobling bekreftet")
 
   def nextValidId(self, orderId): # IB krever at vi bruker deres tildelte ID-nummer for forespørsler
     self.next_valid_id = orderId
+    if self.connected:
+      self.connected_event.set()
     print(f"Neste gyldige ID: {orderId}")
 
   def tickPrice(self, reqId, tickType, price, attrib):
-    if tickType == 4:  # siste pris
+    if tickType == 4 and reqId in self.pending:  # siste pris, bare for forespørsler noen venter på
+      self.data.pop(reqId, None) # pop + innsetting flytter nøkkelen bakerst uten KeyError
       self.data[reqId] = price
+      while len(self.data) > 1024: # Unngå at priser fra tapte kanselleringer hoper seg opp
+        self.data.popitem(last=False)
+      ev = self.pending.get(reqId)
+      if ev:
+        ev.set() # Vekk get_market_data med en gang
       print(f"Pris for reqId {reqId}: {price}")
 
+  def tickSnapshotEnd(self, reqId): # Snapshot ferdig, vekk ventende også uten siste pris
+    ev = self.pending.get(reqId)
+    if ev:
+      ev.set()
+
+  def next_req_id(self): # Unik reqId for hver forespørsel på denne tilkoblingen
+    return next(self.req_ids)
+
+  def safe_req(self, fn, *args): # Sender en forespørsel når rate limiten tillater det
+    self.bucket.acquire()
+    return fn(*args)
+
 def create_contract(symbol, sec_type="STK", exchange="SMART", currency="USD"):
   contract = Contract()
   contract.symbol = symbol
@@ -40,25 +94,46 @@ def create_contract(symbol, sec_type="STK", exchange="SMART", currency="USD"):
   contract.currency = currency
   return contract
 
+def run_reader(app):
+  # Kjører IB-meldingsløkken, på Linux festet til én kjerne med høyere prioritet
+  if platform.system() == "Linux":
+    try:
+      cpus = os.sched_getaffinity(0) # 0 = kallende tråd på Linux
+      if len(cpus) > 1:
+        os.sched_setaffinity(0, {max(cpus)})
+    except OSError:
+      pass
+    try:
+      os.nice(-5) # Gjelder bare denne tråden, krever vanligvis rettigheter
+    except OSError:
+      pass
+  app.run()
+
 def connect_to_ib(app, host="127.0.0.1", port=7497, client_id=100):
   # Kobler til IB TWS/Gateway
   try:
     app.connect(host, port, client_id)
     app.connection_error = None
+    app.connected_event.clear()
     
-    thread = threading.Thread(target=app.run, daemon=True)
-    thread.start()
+    app.reader_thread = threading.Thread(target=run_reader, args=(app,), daemon=True)
+    app.reader_thread.start()
     
     # Vent på tilkobling og neste gyldige ID
     timeout = 15
-    start_time = time.time()
-    while (not app.connected or app.next_valid_id is None) and time.time() - start_time < timeout:
+    deadline = time.time() + timeout
+    while not app.connected or app.next_valid_id is None:
+      remaining = deadline - time.time()
+      if remaining <= 0 or not app.connected_event.wait(timeout=remaining):
+        break
       if app.connection_error:
         raise ConnectionError(f"Kunne ikke koble til: {app.connection_error}")
-      time.sleep(0.5)
+      app.connected_event.clear() # Feilmelding uten at tilkoblingen er klar ennå
       
     if not app.connected or app.next_valid_id is None:
       raise ConnectionError("Timeout: Kunne ikke etablere full tilkobling til IB")
+    
+    app.req_ids = itertools.count(app.next_valid_id) # Unngår kolliderende reqId ved gjenbruk
       
     print("Tilkobling vellykket og klar for handel")
     return True
@@ -67,18 +142,47 @@ def connect_to_ib(app, host="127.0.0.1", port=7497, client_id=100):
     print(f"Tilkoblingsfeil: {e}")
     return False
 
-def get_market_data(app, contract, req_id=1, timeout=10):
+def disconnect_from_ib(app, timeout=5):
+  # Kobler fra IB og venter på at lesetråden avsluttes
   try:
-    # Be om markedsdata
-    app.reqMktData(req_id, contract, "", False, False, [])
+    app.disconnect()
+    if app.reader_thread is not None:
+      app.reader_thread.join(timeout=timeout)
+    print("Koblet fra IB")
+  except Exception as e:
+    print(f"Kunne ikke koble fra ren: {e}")
+
+@functools.cache
+def get_app():
+  # Delt tilkobling som gjenbrukes for alle forespørsler i prosessen
+  app = TradingApp()
+  if not connect_to_ib(app):
+    app.disconnect()
+    raise ConnectionError("Kunne ikke koble til IB") # Unntak caches ikke, neste kall prøver igjen
+  atexit.register(disconnect_from_ib, app) # Koble fra når programmet avsluttes
+  return app
+
+def get_market_data(app, contract, req_id=None, timeout=10, snapshot=True):
+  if req_id is None:
+    req_id = app.next_req_id()
+  try:
+    # Registrer event før forespørselen slik at ingen tick går tapt
+    ev = threading.Event()
+    app.errors.pop(req_id, None)
+    app.pending[req_id] = ev
+    
+    # Be om markedsdata (snapshot avslutter seg selv etter ett svar)
+    app.safe_req(app.reqMktData, req_id, contract, "", snapshot, False, [])
     print(f"Forespurt markedsdata for {contract.symbol}, reqId: {req_id}")
     
     # Vent på data
-    start_time = time.time()
-    while req_id not in app.data:
-      if time.time() - start_time > timeout:
-        raise TimeoutError("Timeout ved henting av markedsdata")
-      time.sleep(0.5)
+    if not ev.wait(timeout):
+      raise TimeoutError("Timeout ved henting av markedsdata")
+    if req_id in app.errors:
+      raise RuntimeError(app.errors[req_id])
+    
+    if req_id not in app.data:
+      raise LookupError("Snapshot avsluttet uten siste pris")
     
     price = app.data[req_id]
     return price
@@ -88,23 +192,22 @@ def get_market_data(app, contract, req_id=1, timeout=10):
     return None
     
   finally:
-    try:
-      app.cancelMktData(req_id) # Avbryt forespørselen
-      if req_id in app.data:
-        del app.data[req_id] # Fjern data for denne forespørselen
-    except:
-      pass
+    app.pending.pop(req_id, None)
+    app.errors.pop(req_id, None)
+    if not snapshot:
+      try:
+        app.safe_req(app.cancelMktData, req_id) # Avbryt strømmende forespørsel
+      except Exception as e:
+        logger.debug("cancelMktData feilet for reqId %s: %s", req_id, e)
+    app.data.pop(req_id, None) # Fjern data etter kanselleringen slik at ingen tick blir liggende
 
 def main():
-  app = TradingApp()
-  
-  if not connect_to_ib(app):
+  try:
+    app = get_app()
+  except ConnectionError:
     return
   
   try:
-    # Vent litt ekstra for å sikre at tilkoblingen er stabil
-    time.sleep(2)
-    
     symbol = "AAPL"  # Ønsket symbol
     contract = create_contract(symbol)
     
@@ -117,13 +220,8 @@ def main():
 
   except Exception as e:
     print(f"Feil under kjøring: {e}")
-  
-  finally:
-    try:
-      app.disconnect()
-      print("Koblet fra IB")
-    except:
-      print("Kunne ikke koble fra ren")
+  # Tilkoblingen lukkes av atexit når programmet avsluttes
 
 if __name__ == "__main__":
+  logging.basicConfig(level=logging.DEBUG if "-v" in sys.argv[1:] else logging.WARNING) # -v viser debug-logg
   main()
\ No newline at end of file
@@ -1,39 +1,96 @@
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
+import atexit
+import functools
+import itertools
+import logging
+import os
+import platform
+import sys
 import threading
 import time
-from datetime import datetime
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+import cache
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Advarsler fra IB der forespørselen fortsetter og data fortsatt kommer
+WARNING_CODES = {10090, 10167}
+
+def is_warning(errorCode):
+  """Sjekker om en feilkode fra IB bare er en advarsel (avslutter ikke forespørselen)"""
+  return 2100 <= errorCode <= 2199 or errorCode in WARNING_CODES
 
 class TradingApp(EWrapper, EClient):
   """Hovedklassen som arver fra både EWrapper og EClient for IB API kommunikasjon"""
   
   def __init__(self):
     EClient.__init__(self, self)
-    # Dictionary for å lagre markedsdata med request ID som nøkkel
-    self.data = {}
+    # Markedsdata med request ID som nøkkel, begrenset i størrelse (eldste fjernes først)
+    self.data = OrderedDict()
+    # Event per request ID som signaliseres når svar (eller feil) er mottatt
+    self.pending = {}
+    # Resultater fra forespørsler med request ID som nøkkel
+    self.results = {}
+    # Feilmeldinger fra IB med request ID som nøkkel
+    self.errors = {}
     # Event for å signalisere når tilkoblingen er etablert
     self.connected_event = threading.Event()
     # Neste gyldige ordre-ID fra IB
     self.next_valid_id = None
+    # Teller for request ID-er, startes fra next_valid_id når tilkoblingen er klar
+    self.req_ids = None
+    # Kommunikasjons-tråden som leser meldinger fra IB
+    self.reader_thread = None
+    # Rate limiter for utgående meldinger (IB tillater maks 50 per sekund)
+    self.bucket = TokenBucket()
     # Liste for å lagre opsjonskjeder
     self.opt_params_list = []
-    # Event for å signalisere når contract details er mottatt
-    self.contract_details_event = threading.Event()
-    # Resultatet fra contract details forespørsel
-    self.contract_details_result = None
+    # Innholdet i kjeder som allerede er mottatt, for å hoppe over duplikater
+    self._seen_chain_hashes = set()
+    # Børser vi beholder opsjonskjeder for (SMART ruter til alle de andre)
+    self.target_exchanges = {"SMART"}
+    # Event for å signalisere når alle opsjonskjeder er mottatt
+    self.opt_params_done = threading.Event()
 
   def error(self, reqId, errorCode, errorString):
     """Håndterer feilmeldinger fra IB"""
     # Ignorerer visse informasjonsmeldinger
     if errorCode not in [2104, 2106, 2158]:
       print(f"Error: {reqId} | {errorCode} | {errorString}")
-      # Hvis det er en contract details feil, signaliser at forespørselen er ferdig
-      if reqId == 10:  # Contract details request
-        self.contract_details_event.set()
+      # Hvis noen venter på denne forespørselen, lagre feilen og vekk dem.
+      # Advarsler skrives bare ut siden data fortsatt kommer for forespørselen
+      if reqId in self.pending and not is_warning(errorCode):
+        self.errors[reqId] = errorString
+        self._notify(reqId)
+
+  def next_req_id(self):
+    """Tildeler en ny unik request ID for denne tilkoblingen"""
+    return next(self.req_ids)
+
+  def safe_req(self, fn, *args):
+    """Kaller en forespørsel-metode etter å ha fått et token fra rate limiteren"""
+    self.bucket.acquire()
+    return fn(*args)
+
+  def _notify(self, reqId):
+    """Vekker den som venter på svar for gitt request ID"""
+    ev = self.pending.get(reqId)
+    if ev:
+      ev.set()
 
   def connectAck(self):
     """Bekrefter at tilkoblingen til IB er etablert"""
+    # Data fra en tidligere tilkobling er ikke lenger gyldig
+    self.data.clear()
+    self.opt_params_list.clear()
+    self._seen_chain_hashes.clear()
     print("Tilkobling bekreftet")
 
   def nextValidId(self, orderId):
@@ -44,34 +101,80 @@ class TradingApp(EWrapper, EClient):
 
   def tickPrice(self, reqId, tickType, price, attrib):
     """Håndterer prisoppdateringer fra IB"""
-    if tickType == 4:  # Siste pris (LAST)
+    # Ignorer ticks for forespørsler ingen venter på (f.eks. sene snapshot-ticks)
+    if tickType == 4 and reqId in self.pending:  # Siste pris (LAST)
+      # pop + innsetting flytter nøkkelen bakerst uten å feile hvis den nettopp ble fjernet
+      self.data.pop(reqId, None)
       self.data[reqId] = price  # Lagrer prisen med request ID som nøkkel
+      # Unngå at priser fra tapte kanselleringer hoper seg opp
+      while len(self.data) > 1024:
+        self.data.popitem(last=False)
+      self._notify(reqId)  # Signaliser at prisen er mottatt
+
+  def tickSnapshotEnd(self, reqId):
+    """Signaliserer at et snapshot er ferdig, også hvis ingen siste pris ble sendt"""
+    self._notify(reqId)
 
   def securityDefinitionOptionParameter(self, reqId, exchange, underlyingConId, tradingClass, multiplier, expirations, strikes):
     """Mottar opsjonsparametre (kjeder) for et underlying instrument"""
+    # Hopp over kjeder fra børser vi ikke skal bruke før vi gjør noe arbeid med dem
+    if exchange not in self.target_exchanges:
+      return
     # FILTRER: Bare lagre kjeder med tilstrekkelig mange strikes og expirations
     if expirations and strikes and len(expirations) > 5 and len(strikes) > 10:
-      params = {
-        "exchange": exchange,
-        "expirations": sorted(expirations),  # Sorterte utløpsdatoer
-        "strikes": sorted(strikes)  # Sorterte strike-priser
-      }
+      # Hopp over kjeder med samme strikes og utløp som en vi allerede har (f.eks. fra en annen børs)
+      key = (frozenset(expirations), frozenset(strikes))
+      if key in self._seen_chain_hashes:
+        return
+      self._seen_chain_hashes.add(key)
+      params = build_chain_params(exchange, expirations, strikes)
       self.opt_params_list.append(params)
       print(f"Opsjonskjede mottatt: {exchange} - {len(expirations)} exp, {len(strikes)} strikes")
     else:
       # print(f"Filtrert bort: {exchange} - {len(expirations)} exp, {len(strikes)} strikes (for få)")
       pass # trenger ikke logge de med for få strikes/expirations
 
+  def securityDefinitionOptionParameterEnd(self, reqId):
+    """Signaliserer at alle opsjonskjeder for forespørselen er mottatt"""
+    self.opt_params_done.set()
+
   def contractDetails(self, reqId, contractDetails):
     """Mottar detaljerte kontraktinformasjon"""
-    if reqId == 10:
-      self.contract_details_result = contractDetails
-      self.contract_details_event.set()  # Signaliser at data er mottatt
+    if reqId in self.pending:
+      self.results.setdefault(reqId, contractDetails)  # Behold første treff
+      self._notify(reqId)  # Signaliser at data er mottatt
 
   def contractDetailsEnd(self, reqId):
     """Signaliserer slutten på en contract details forespørsel"""
-    if reqId == 10 and not self.contract_details_event.is_set():
-      self.contract_details_event.set()  # Signaliser hvis ingen detaljer ble mottatt
+    self._notify(reqId)  # Signaliser også hvis ingen detaljer ble mottatt
+
+def _parse_yyyymmdd(s):
+  """Tolker en IB-dato (YYYYMMDD) med int-slicing, mye raskere enn strptime"""
+  return date(int(s[0:4]), int(s[4:6]), int(s[6:8]))
+
+def build_chain_params(exchange, expirations, strikes):
+  """Bygger en opsjonskjede med NumPy-arrays forhåndsberegnet for raskt søk"""
+  # Ingen sortering her: søket bruker argmin (O(N), k=1) og trenger ikke sortert input.
+  # Tupler er uforanderlige og holder rekkefølgen lik den i NumPy-arrayene
+  strikes = tuple(strikes)
+  # Tolk utløpsdatoene én gang når kjeden bygges, og hopp over ugyldige datoformater.
+  # Et unntak her ville stoppet IB-tråden, og begge listene må ha samme indekser
+  valid = []
+  parsed = []
+  for e in expirations:
+    try:
+      parsed.append(_parse_yyyymmdd(e))
+    except (TypeError, ValueError):
+      continue
+    valid.append(e)
+  expirations = tuple(valid)
+  return {
+    "exchange": exchange,
+    "expirations": expirations,
+    "strikes": strikes,
+    "expiries_np": np.array(parsed, dtype="datetime64[D]"),
+    "strikes_np": np.fromiter(strikes, dtype=np.float64, count=len(strikes))
+  }
 
 def create_contract(symbol, sec_type="STK", exchange="SMART", currency="USD"):
   """Hjelpefunksjon for å opprette en aksjekontrakt"""
@@ -95,18 +198,38 @@ def create_option_contract(symbol, strike, expiry, right="C", exchange="SMART",
   contract.multiplier = "100"  # Kontraktstørrelse (standard 100 aksjer per opsjon)
   return contract
 
+def run_reader(app):
+  """Kjører IB-meldingsløkken, på Linux festet til én kjerne med høyere prioritet"""
+  if platform.system() == "Linux":
+    try:
+      # Fest tråden til siste tilgjengelige kjerne (0 = kallende tråd på Linux)
+      cpus = os.sched_getaffinity(0)
+      if len(cpus) > 1:
+        os.sched_setaffinity(0, {max(cpus)})
+    except OSError:
+      pass
+    try:
+      # nice gjelder bare den kallende tråden på Linux, krever vanligvis rettigheter
+      os.nice(-5)
+    except OSError:
+      pass
+  app.run()
+
 def connect_to_ib(app, host="127.0.0.1", port=7497, client_id=100):
   """Etablerer tilkobling til IB Gateway/TWS"""
   try:
     # Initier tilkobling
     app.connect(host, port, client_id)
     # Start kommunikasjons-tråd i bakgrunnen
-    thread = threading.Thread(target=app.run, daemon=True)
-    thread.start()
+    app.reader_thread = threading.Thread(target=run_reader, args=(app,), daemon=True)
+    app.reader_thread.start()
     
     # Vent på at tilkoblingen blir etablert (maks 15 sekunder)
     if not app.connected_event.wait(timeout=15):
       raise ConnectionError("Timeout: Kunne ikke etablere tilkobling til IB")
+    
+    # Request ID-er tildeles fra IBs neste gyldige ID for å unngå kollisjoner
+    app.req_ids = itertools.count(app.next_valid_id)
       
     print("Tilkobling vellykket og klar for handel")
     return True
@@ -115,145 +238,224 @@ def connect_to_ib(app, host="127.0.0.1", port=7497, client_id=100):
     print(f"Tilkoblingsfeil: {e}")
     return False
 
-def get_market_data(app, contract, req_id, timeout=10):
-  """Henter markedsdata for en gitt kontrakt"""
+def disconnect_from_ib(app, timeout=5):
+  """Kobler fra IB og venter på at kommunikasjons-tråden avsluttes"""
+  app.disconnect()
+  if app.reader_thread is not None:
+    app.reader_thread.join(timeout=timeout)
+  print("Koblet fra IB")
+
+@functools.cache
+def get_app():
+  """Returnerer en delt, tilkoblet TradingApp som gjenbrukes for alle forespørsler"""
+  app = TradingApp()
+  if not connect_to_ib(app):
+    app.disconnect()
+    # Unntak caches ikke, så neste kall prøver å koble til på nytt
+    raise ConnectionError("Kunne ikke koble til IB")
+  # Koble fra automatisk når programmet avsluttes
+  atexit.register(disconnect_from_ib, app)
+  return app
+
+def request_market_data(app, contract, req_id=None, snapshot=True):
+  """Sender forespørsel om markedsdata uten å vente på svar, returnerer request ID"""
+  if req_id is None:
+    req_id = app.next_req_id()
+  # Registrer event før forespørselen slik at ingen tick går tapt
+  app.errors.pop(req_id, None)
+  app.pending[req_id] = threading.Event()
+  
+  # Forespør markedsdata fra IB (snapshot avslutter seg selv etter ett svar)
   try:
-    # Forespør markedsdata fra IB
-    app.reqMktData(req_id, contract, "", False, False, [])
-    print(f"Forespurt markedsdata for {contract.symbol}, reqId: {req_id}")
-    
+    app.safe_req(app.reqMktData, req_id, contract, "", snapshot, False, [])
+  except Exception:
+    # Forespørselen ble aldri sendt, så ingen vil vente på den
+    app.pending.pop(req_id, None)
+    raise
+  print(f"Forespurt markedsdata for {contract.symbol}, reqId: {req_id}")
+  return req_id
+
+def await_market_data(app, req_id, timeout=10, snapshot=True):
+  """Venter på prisen for en tidligere sendt forespørsel og kansellerer strømming"""
+  try:
+    ev = app.pending.get(req_id)
     # Vent på at data blir mottatt (maks 10 sekunder)
-    start_time = time.time()
-    while req_id not in app.data:
-      if time.time() - start_time > timeout:
-        raise TimeoutError("Timeout ved henting av markedsdata")
-      time.sleep(0.1)
+    if ev is None or not ev.wait(timeout):
+      raise TimeoutError("Timeout ved henting av markedsdata")
     
-    # Returner den mottatte prisen
-    return app.data[req_id]
+    # IB svarte med en feil for denne forespørselen
+    if req_id in app.errors:
+      print(f"Feil ved henting av markedsdata for reqId {req_id}: {app.errors[req_id]}")
+      return None
+    
+    # Returner den mottatte prisen (None hvis snapshot ble avsluttet uten siste pris)
+    return app.data.get(req_id)
     
   finally:
-    # Alltid kanseller forespørselen og rydd opp i data
-    try:
-      app.cancelMktData(req_id)
-      if req_id in app.data:
-        del app.data[req_id]
-    except:
-      pass
+    # Kanseller strømmende forespørsler og rydd alltid opp i data
+    app.pending.pop(req_id, None)
+    app.errors.pop(req_id, None)
+    if not snapshot:
+      try:
+        app.safe_req(app.cancelMktData, req_id)
+      except Exception as e:
+        # En feilet kansellering betyr et lekket abonnement, vis det med -v
+        logger.debug("cancelMktData feilet for reqId %s: %s", req_id, e)
+    # Fjern data etter kanselleringen slik at ingen tick blir liggende igjen
+    app.data.pop(req_id, None)
 
-def get_contract_details(app, contract, req_id=10, timeout=10):
+def get_market_data(app, contract, req_id=None, timeout=10, snapshot=True):
+  """Henter markedsdata for en gitt kontrakt"""
+  req_id = request_market_data(app, contract, req_id, snapshot)
+  return await_market_data(app, req_id, timeout, snapshot)
+
+def get_contract_details(app, contract, req_id=None, timeout=10):
   """Henter detaljert kontraktinformasjon fra IB"""
-  # Tilbakestill event og resultat før ny forespørsel
-  app.contract_details_event.clear()
-  app.contract_details_result = None
-  
-  # Send forespørsel om kontraktdetaljer
-  app.reqContractDetails(req_id, contract)
-  print(f"Forespurt contract details for {contract.symbol}, reqId: {req_id}")
+  if req_id is None:
+    req_id = app.next_req_id()
+  # Registrer forespørselen og fjern gamle resultater før ny forespørsel
+  ev = threading.Event()
+  app.pending[req_id] = ev
+  app.results.pop(req_id, None)
+  app.errors.pop(req_id, None)
   
-  # Vent på svar (maks 10 sekunder)
-  if not app.contract_details_event.wait(timeout=timeout):
-    raise TimeoutError("Timeout ved henting av contract details")
-  
-  # Returner resultatet
-  return app.contract_details_result
+  try:
+    # Send forespørsel om kontraktdetaljer
+    app.safe_req(app.reqContractDetails, req_id, contract)
+    print(f"Forespurt contract details for {contract.symbol}, reqId: {req_id}")
+    
+    # Vent på svar (maks 10 sekunder)
+    if not ev.wait(timeout=timeout):
+      raise TimeoutError("Timeout ved henting av contract details")
+    
+    # Ved feil fra IB returneres None (error() har allerede skrevet ut feilen)
+    if req_id in app.errors:
+      return None
+    
+    # Returner resultatet
+    return app.results.get(req_id)
+    
+  finally:
+    # Rydd opp slik at forespørselen ikke henger igjen
+    app.pending.pop(req_id, None)
+    app.results.pop(req_id, None)
+    app.errors.pop(req_id, None)
 
-def find_best_option_chain(opt_params_list, current_price):
+def find_best_option_chain(opt_params_list, current_price, today=None):
   """Finn den beste opsjonskjeden basert på nærhet til gjeldende pris"""
   if not opt_params_list:
     return None
     
-  best_chain = None
-  best_strike_diff = float('inf')  # Start med uendelig differanse
+  # Dagens dato hentes én gang, bare hele dager betyr noe for utløp
+  if today is None:
+    today = date.today()
+  today = np.datetime64(today, "D")
   
-  # Gå gjennom alle mottatte opsjonskjeder
-  for params in opt_params_list:
-    strikes = params["strikes"]
-    expirations = params["expirations"]
-    
-    # Hopp over ufullstendige kjeder
-    if not strikes or not expirations:
-      continue
-      
-    # Finn nærmeste strike-pris til gjeldende markedspris
-    nearest_strike = min(strikes, key=lambda x: abs(x - current_price))
-    strike_diff = abs(nearest_strike - current_price)
-    
-    # Finn nærmeste fremtidige utløpsdato
-    now = datetime.now()
-    nearest_expiry = None
-    expiry_diff = float('inf')
-    
-    for expiry in expirations:
-      try:
-        # Konverter til datetime-objekt
-        expiry_date = datetime.strptime(expiry, '%Y%m%d')
-        # Sjekk at datoen er i fremtiden
-        if expiry_date > now:
-          days_diff = (expiry_date - now).days
-          # Finn den nærmeste datoen
-          if days_diff < expiry_diff:
-            expiry_diff = days_diff
-            nearest_expiry = expiry
-      except ValueError:
-        continue  # Hopp over ugyldige datoformater
-    
-    # Hopp over hvis ingen gyldig utløpsdato ble funnet
-    if nearest_expiry is None:
-      continue
-      
-    # Velg kjeden med strike nærmest gjeldende pris
-    if strike_diff < best_strike_diff:
-      best_strike_diff = strike_diff
-      best_chain = {
-        "exchange": params["exchange"],
-        "strike": nearest_strike,
-        "expiry": nearest_expiry,
-        "strike_diff": strike_diff,
-        "expiry_diff": expiry_diff
-      }
+  def score(params):
+    """Rangerer en kjede etter (strike-avstand, dager til nærmeste fremtidige utløp)"""
+    strikes_np = params["strikes_np"]
+    if not strikes_np.size:
+      return (float('inf'), float('inf'))  # Ufullstendig kjede
+    days = (params["expiries_np"] - today).astype(int)
+    future = days[days > 0]
+    if not future.size:
+      return (float('inf'), float('inf'))  # Ingen gyldig utløpsdato
+    return (float(np.abs(strikes_np - current_price).min()), int(future.min()))
+  
+  # Velg kjeden med strike nærmest gjeldende pris i én passering (min er implementert i C)
+  best = min(opt_params_list, key=score)
+  
+  # Hent detaljene bare for den valgte kjeden
+  strikes_np = best["strikes_np"]
+  if not strikes_np.size:
+    return None
+  days = (best["expiries_np"] - today).astype(int)
+  future_idx = np.flatnonzero(days > 0)
+  if not future_idx.size:
+    return None  # Ingen kjede hadde en gyldig utløpsdato
+  expiry_idx = future_idx[days[future_idx].argmin()]
   
-  return best_chain
+  strike_diffs = np.abs(strikes_np - current_price)
+  # Ved lik avstand vinner laveste strike, som med sortert input før (uavhengig av IBs rekkefølge)
+  tied = np.flatnonzero(strike_diffs == strike_diffs.min())
+  strike_idx = tied[strikes_np[tied].argmin()]
+  return {
+    "exchange": best["exchange"],
+    "strike": float(strikes_np[strike_idx]),
+    "expiry": best["expirations"][expiry_idx],
+    "strike_diff": float(strike_diffs[strike_idx]),
+    "expiry_diff": int(days[expiry_idx])
+  }
 
 def main():
   """Hovedfunksjon som kjører hele prosessen"""
-  # Opprett trading app-instans
-  app = TradingApp()
-  
-  # Koble til IB
-  if not connect_to_ib(app):
+  # Hent den delte, tilkoblede trading app-instansen
+  try:
+    app = get_app()
+  except ConnectionError:
     return  # Avslutt hvis tilkobling feiler
   
   try:
-    # Vent litt for at tilkoblingen skal stabilisere
-    time.sleep(1)
-    
     # Definer aksjen vi er interessert i
     symbol = "AAPL"
     # Opprett kontrakt for aksjen
     contract = create_contract(symbol)
     
     # Hent gjeldende markedspris for aksjen
-    price = get_market_data(app, contract, 1)
+    price = get_market_data(app, contract)
     if price is None:
       print(f"Kunne ikke hente pris for {symbol}")
       return
     print(f"Gjeldende pris for {symbol}: {price}")
 
-    # Hent kontraktdetaljer for å få conId (kontrakt-ID)
-    details = get_contract_details(app, contract)
-    # Bruk conId hvis tilgjengelig, ellers bruk 0 (vil søke med symbol)
-    conId = details.contract.conId if details else 0
+    # Bruk cachet conId (kontrakt-ID) hvis tilgjengelig, den endrer seg ikke
+    conId = cache.get_conid(symbol)
+    if conId is None:
+      # Hent kontraktdetaljer for å få conId
+      details = get_contract_details(app, contract)
+      # Bruk conId hvis tilgjengelig, ellers bruk 0 (vil søke med symbol)
+      conId = details.contract.conId if details else 0
+      if conId:
+        cache.put_conid(symbol, conId)
     print(f"Contract ID: {conId}")
 
-    # Tøm liste med opsjonskjeder fra tidligere forespørsler
-    app.opt_params_list = []
-    # Forespør opsjonsparametre (kjeder) for aksjen
-    app.reqSecDefOptParams(2, symbol, "", "STK", conId)
-    print("Venter på opsjonskjeder...")
+    # Samme handelsdag for cache og utløpssøk, selv om kjøringen krysser midnatt
+    today = date.today()
     
-    # Vent tilstrekkelig lenge for å motta alle opsjonskjedene
-    time.sleep(3)
+    # Bruk cachede opsjonskjeder for i dag hvis de fortsatt er gyldige
+    cached_chains = cache.get_chains(symbol, today)
+    if cached_chains is not None:
+      app.opt_params_list = [
+        build_chain_params(c["exchange"], c["expirations"], c["strikes"])
+        for c in cached_chains if c["exchange"] in app.target_exchanges
+      ]
+      print("Bruker cachede opsjonskjeder")
+    else:
+      # Tøm liste med opsjonskjeder fra tidligere forespørsler
+      app.opt_params_done.clear()
+      app.opt_params_list = []
+      app._seen_chain_hashes.clear()
+      # Registrer forespørselen slik at en feil fra IB vekker oss med en gang
+      opt_req_id = app.next_req_id()
+      app.pending[opt_req_id] = app.opt_params_done
+      app.errors.pop(opt_req_id, None)
+      # Forespør opsjonsparametre (kjeder) for aksjen
+      app.safe_req(app.reqSecDefOptParams, opt_req_id, symbol, "", "STK", conId)
+      print("Venter på opsjonskjeder...")
+      
+      # Vent til IB signaliserer at alle opsjonskjedene er sendt (maks 10 sekunder)
+      done = app.opt_params_done.wait(timeout=10)
+      app.pending.pop(opt_req_id, None)
+      if not done:
+        print("Timeout ved henting av opsjonskjeder")
+      elif opt_req_id in app.errors:
+        print(f"Feil ved henting av opsjonskjeder: {app.errors.pop(opt_req_id)}")
+      elif app.opt_params_list:
+        # Cache kun komplette svar
+        cache.put_chains(symbol, [
+          {"exchange": p["exchange"], "expirations": p["expirations"], "strikes": p["strikes"]}
+          for p in app.opt_params_list
+        ], today)
     
     # Sjekk om noen opsjonskjeder ble mottatt
     if not app.opt_params_list:
@@ -263,7 +465,7 @@ def main():
     print(f"Mottatt {len(app.opt_params_list)} opsjonskjeder")
     
     # Finn den beste opsjonskjeden basert på gjeldende pris
-    best_option = find_best_option_chain(app.opt_params_list, price)
+    best_option = find_best_option_chain(app.opt_params_list, price, today)
     
     if not best_option:
       print("Kunne ikke finne passende opsjon")
@@ -275,8 +477,9 @@ def main():
     print(f"  Strike: {best_option['strike']} (diff: {best_option['strike_diff']:.2f})")
     print(f"  Utløp: {best_option['expiry']} (om {best_option['expiry_diff']} dager)")
 
-    # Hent priser for både call og put opsjoner
-    for right, req_id in [("C", 3), ("P", 4)]:
+    # Send forespørsler for både call og put før vi venter, slik at ventetiden overlapper
+    option_requests = []
+    for right in ["C", "P"]:
       # Opprett opsjonskontrakt
       option_contract = create_option_contract(
         symbol, 
@@ -285,9 +488,15 @@ def main():
         right, 
         exchange=best_option["exchange"]
       )
-      
-      # Hent markedspris for opsjonen
-      option_price = get_market_data(app, option_contract, req_id)
+      option_requests.append((right, request_market_data(app, option_contract)))
+
+    # Vent på markedspris for hver opsjon, med felles frist (maks 10 sekunder totalt)
+    deadline = time.monotonic() + 10
+    for right, req_id in option_requests:
+      try:
+        option_price = await_market_data(app, req_id, max(0, deadline - time.monotonic()))
+      except TimeoutError:
+        option_price = None
       if option_price is not None:
         print(f"{right} opsjonspris: {option_price}")
       else:
@@ -296,11 +505,9 @@ def main():
   except Exception as e:
     # Håndter eventuelle feil under kjøring
     print(f"Feil under kjøring: {e}")
-  finally:
-    # Alltid koble fra IB til slutt
-    app.disconnect()
-    print("Koblet fra IB")
+  # Tilkoblingen lukkes av atexit når programmet avsluttes
 
 if __name__ == "__main__":
-  # Kjør hovedfunksjonen når scriptet kjøres direkte
+  # Kjør hovedfunksjonen når scriptet kjøres direkte (-v viser debug-logg)
+  logging.basicConfig(level=logging.DEBUG if "-v" in sys.argv[1:] else logging.WARNING)
   main()
\ No newline at end of file
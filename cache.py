@@ -0,0 +1,70 @@
+import json
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+# Rotmappe for cache, ved siden av skriptene
+CACHE_DIR = Path(__file__).resolve().parent / ".cache" / "ib"
+
+# Levetid i sekunder for opsjonskjeder
+TODAY_CHAINS_TTL = 15 * 60  # Dagens kjeder kan endre seg i løpet av dagen
+HISTORICAL_CHAINS_TTL = 30 * 24 * 60 * 60  # Historiske kjeder endrer seg ikke
+
+def calculate_ttl(trading_date, now=None):
+  """Beregner hvor lenge (sekunder) data for en handelsdag kan caches"""
+  if now is None:
+    now = datetime.now()
+  today = now.date() if isinstance(now, datetime) else now
+  if trading_date < today:
+    return HISTORICAL_CHAINS_TTL
+  return TODAY_CHAINS_TTL
+
+def _read(path, ttl=None):
+  """Leser en cache-fil, returnerer None hvis den mangler, er ødelagt eller utløpt"""
+  try:
+    with open(path, "r", encoding="utf-8") as f:
+      entry = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if not isinstance(entry, dict) or "data" not in entry:
+    return None
+  if ttl is not None and time.time() - entry.get("saved_at", 0) > ttl:
+    return None
+  return entry["data"]
+
+def _write(path, data):
+  """Skriver data til en cache-fil (atomisk via midlertidig fil)"""
+  try:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      json.dump({"saved_at": time.time(), "data": data}, f)
+    tmp_path.replace(path)
+  except OSError as e:
+    print(f"Kunne ikke skrive cache {path}: {e}")
+
+def _conid_path(symbol):
+  return CACHE_DIR / symbol / "conid.json"
+
+def _chains_path(symbol, trading_date):
+  return CACHE_DIR / symbol / trading_date.strftime("%Y%m%d") / "chains.json"
+
+def get_conid(symbol):
+  """Henter cachet conId for symbolet (conId endrer seg ikke, så ingen utløpstid)"""
+  return _read(_conid_path(symbol))
+
+def put_conid(symbol, conid):
+  """Lagrer conId for symbolet"""
+  _write(_conid_path(symbol), conid)
+
+def get_chains(symbol, trading_date=None):
+  """Henter cachede opsjonskjeder for symbolet og handelsdagen"""
+  if trading_date is None:
+    trading_date = date.today()
+  return _read(_chains_path(symbol, trading_date), calculate_ttl(trading_date))
+
+def put_chains(symbol, chains, trading_date=None):
+  """Lagrer opsjonskjeder for symbolet og handelsdagen"""
+  if trading_date is None:
+    trading_date = date.today()
+  _write(_chains_path(symbol, trading_date), chains)
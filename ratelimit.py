@@ -0,0 +1,30 @@
+import threading
+import time
+
+class TokenBucket:
+  """Token bucket som holder meldinger til IB på maks 50 per sekund (burst + påfyll per sekund <= 50)"""
+
+  def __init__(self, rate=45, capacity=5):
+    # Antall tokens som fylles på per sekund
+    self.rate = rate
+    # Maks antall tokens som kan spares opp (tillatt burst)
+    self.capacity = capacity
+    self.tokens = capacity
+    self.last_refill = time.monotonic()
+    self.lock = threading.Lock()
+
+  def _refill(self):
+    """Fyller på tokens basert på tiden siden forrige påfylling"""
+    now = time.monotonic()
+    self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+    self.last_refill = now
+
+  def acquire(self):
+    """Tar ett token, og venter bare så lenge som trengs hvis bøtta er tom"""
+    with self.lock:
+      self._refill()
+      if self.tokens < 1:
+        # Vent til neste token er klart (maks 1/rate sekunder)
+        time.sleep((1 - self.tokens) / self.rate)
+        self._refill()
+      self.tokens -= 1